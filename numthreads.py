@@ -2,31 +2,90 @@
 
 from __future__ import annotations
 
-import argparse
 import contextlib
-import ctypes
+import functools
 import os
-import platform
 import sys
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from collections.abc import Generator
+    import ctypes
+    from collections.abc import Callable, Generator, Iterable
 
     import pytest
 
 __version__ = "0.5.0"
 
-THREAD_CONTROL_ENV_VARS = [
+THREAD_CONTROL_ENV_VARS = (
     "OPENBLAS_NUM_THREADS",  # OpenBLAS
     "MKL_NUM_THREADS",  # MKL
     "OMP_NUM_THREADS",  # OMP
     "NUMEXPR_NUM_THREADS",  # NumExpr
     "VECLIB_MAXIMUM_THREADS",  # Accelerate
-]
-
-
-def set_num_threads(n: int = 1, *, overwrite: bool = True) -> None:
+)
+
+# ``os.environ`` at import and its underlying mapping, used to keep it in sync when
+# calling ``os.putenv``; only valid while ``os.environ`` is still this object
+_ENVIRON = os.environ
+_ENVIRON_DATA: dict | None = getattr(_ENVIRON, "_data", None)
+# The ``_ENVIRON`` keys of ``THREAD_CONTROL_ENV_VARS``, encoded once at import
+_ENCODED_ENV_VARS = (
+    tuple(map(_ENVIRON.encodekey, THREAD_CONTROL_ENV_VARS))  # type: ignore[attr-defined]
+    if _ENVIRON_DATA is not None
+    else ()
+)
+# Variables set with ``fast=True``, for which ``os.environ`` may be out of date
+_UNSYNCED_ENV_VARS: set[str] = set()
+
+# ``str(n)`` of common thread counts, to avoid converting them on each call
+_SMALL_INT_STRS = tuple(str(i) for i in range(257))
+
+# Commands printed by the CLI, with ``_N`` to be replaced by the number of threads
+_N = "<<N>>"
+_EXPORT_TEMPLATES = {
+    "win32": 'powershell.exe -Command "{}"'.format(
+        " & ".join(f"$env:{var}='{_N}'" for var in THREAD_CONTROL_ENV_VARS),
+    ),
+    "default": " ; ".join(f"export {var}='{_N}'" for var in THREAD_CONTROL_ENV_VARS),
+}
+_EXPORT_TEMPLATE = _EXPORT_TEMPLATES.get(sys.platform, _EXPORT_TEMPLATES["default"])
+
+# OpenMP runtime per `sys.platform`, resolved once at import (None if unsupported)
+_OMP_LIB_NAME = {
+    "darwin": "libomp.dylib",
+    "linux": "libgomp.so.1",
+    "win32": "libiomp5md.dll",
+}.get(sys.platform)
+
+
+# Thread count setters of BLAS libraries per `sys.platform`, as (library, function)
+_BLAS_SETTER_NAMES = {
+    "darwin": (
+        ("libopenblas.0.dylib", "openblas_set_num_threads"),
+        ("libmkl_rt.2.dylib", "MKL_Set_Num_Threads"),
+        ("libmkl_rt.dylib", "MKL_Set_Num_Threads"),
+    ),
+    "linux": (
+        ("libopenblas.so.0", "openblas_set_num_threads"),
+        ("libmkl_rt.so.2", "MKL_Set_Num_Threads"),
+        ("libmkl_rt.so", "MKL_Set_Num_Threads"),
+    ),
+    "win32": (
+        ("libopenblas.dll", "openblas_set_num_threads"),
+        ("mkl_rt.2.dll", "MKL_Set_Num_Threads"),
+        ("mkl_rt.dll", "MKL_Set_Num_Threads"),
+    ),
+}.get(sys.platform, ())
+# Cache of the setters found by `_find_blas_setters`, keyed by library name
+_BLAS_SETTERS: dict[str, Callable[[int], None]] = {}
+
+
+def set_num_threads(
+    n: int = 1,
+    *,
+    overwrite: bool = True,
+    fast: bool = False,
+) -> None:
     """Set the number of threads via environment variables.
 
     Sets the following environment variables:
@@ -43,17 +102,60 @@ def set_num_threads(n: int = 1, *, overwrite: bool = True) -> None:
     NumPy. When using OMP (OpenMP), you can use the ``omp_set_num_threads`` function
     to change the number of threads *after* importing the library.
 
+    Variables that already have the requested value are not written again. This
+    relies on ``os.environ`` matching the process environment, which is not the
+    case after changing it directly with ``os.putenv`` or C-level ``setenv``
+    (writes with ``fast=True`` are tracked and always written again).
+
     Parameters
     ----------
     n
         Number of threads to set.
     overwrite
         If true, overwrite the existing value.
+    fast
+        If true, only set the variables in the process environment (which is what
+        C libraries and subprocesses read) using ``os.putenv``, without updating
+        ``os.environ``. This is faster, but ``os.environ`` will not reflect the
+        change, also not for the ``overwrite`` check of subsequent calls.
 
     """
-    for var in THREAD_CONTROL_ENV_VARS:
-        if overwrite or var not in os.environ:
-            os.environ[var] = str(n)
+    env = os.environ
+    # Exact ints only, so bools and floats keep ``str(n)``
+    if type(n) is int and 0 <= n < len(_SMALL_INT_STRS):  # noqa: E721
+        value = _SMALL_INT_STRS[n]
+    else:
+        value = str(n)
+    unsynced = _UNSYNCED_ENV_VARS
+    if fast:
+        for var in THREAD_CONTROL_ENV_VARS:
+            if overwrite or var not in env:
+                os.putenv(var, value)
+                unsynced.add(var)
+        return
+
+    # The pre-encoded keys and ``data`` belong to ``_ENVIRON``
+    data = getattr(env, "_data", None)
+    if env is not _ENVIRON or data is not _ENVIRON_DATA or data is None:
+        # ``os.environ`` is not the mapping from import time (e.g., patched in tests)
+        for var in THREAD_CONTROL_ENV_VARS:
+            current = env.get(var)
+            if (overwrite or current is None) and (current != value or var in unsynced):
+                env[var] = value
+                unsynced.discard(var)
+        return
+
+    # Same as ``os.environ[var] = value`` but without re-encoding keys and value,
+    # and skipping the ``putenv`` call when the value is already set
+    encoded_value = env.encodevalue(value)  # type: ignore[attr-defined]
+    for var, key in zip(THREAD_CONTROL_ENV_VARS, _ENCODED_ENV_VARS):
+        current = data.get(key)
+        if (overwrite or current is None) and (
+            current != encoded_value or var in unsynced
+        ):
+            os.putenv(key, encoded_value)
+            data[key] = encoded_value
+            unsynced.discard(var)
 
 
 # Function alias
@@ -63,40 +165,193 @@ set = set_num_threads  # noqa: A001
 @contextlib.contextmanager
 def num_threads(n: int = 1, *, overwrite: bool = True) -> Generator[None, None, None]:
     """Context manager to set and then restore thread number settings."""
-    original_settings = {var: os.environ.get(var) for var in THREAD_CONTROL_ENV_VARS}
+    env = os.environ
+    to_set = {var: env[var] for var in THREAD_CONTROL_ENV_VARS if var in env}
+    to_unset = [var for var in THREAD_CONTROL_ENV_VARS if var not in to_set]
 
     set_num_threads(n, overwrite=overwrite)
 
     try:
         yield
     finally:
-        for var, value in original_settings.items():
-            if value is None:  # pragma: no cover
-                os.environ.pop(var, None)
-            else:
-                os.environ[var] = value
+        get = env.get
+        unsynced = _UNSYNCED_ENV_VARS
+        env.update(
+            {
+                var: value
+                for var, value in to_set.items()
+                if var in unsynced or get(var) != value
+            },
+        )
+        for var in to_unset:
+            if var in unsynced:
+                env[var] = ""  # let ``os.environ`` know it is set, so it gets unset
+            env.pop(var, None)
+        unsynced.clear()
+
+
+def set_num_threads_runtime(n: int = 1, *, overwrite: bool = True) -> None:
+    """Set the number of threads, also for already loaded libraries.
+
+    Calls `set_num_threads` and, if `threadpoolctl
+    <https://github.com/joblib/threadpoolctl>`_ is installed, also limits the
+    thread pools of the BLAS and OpenMP libraries that are *already* loaded, which
+    the environment variables no longer affect.
+
+    Parameters
+    ----------
+    n
+        Number of threads to set.
+    overwrite
+        If true, overwrite the existing values of the environment variables.
+
+    """
+    set_num_threads(n, overwrite=overwrite)
+    try:
+        import threadpoolctl  # type: ignore[import-not-found]
+    except ImportError:
+        pass
+    else:
+        threadpoolctl.threadpool_limits(limits=n)
 
 
+@contextlib.contextmanager
+def num_threads_runtime(
+    n: int = 1,
+    *,
+    overwrite: bool = True,
+) -> Generator[None, None, None]:
+    """Context manager version of `set_num_threads_runtime`.
+
+    Restores both the environment variables and, if `threadpoolctl` is installed,
+    the thread pool sizes of the loaded libraries on exit.
+    """
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(num_threads(n, overwrite=overwrite))
+        try:
+            import threadpoolctl  # type: ignore[import-not-found]
+        except ImportError:
+            pass
+        else:
+            stack.enter_context(threadpoolctl.threadpool_limits(limits=n))
+        yield
+
+
+def pin_to_cpus(cpus: Iterable[int]) -> None:
+    """Pins the calling thread, and threads it starts afterwards, to the given CPUs.
+
+    Threads that are started afterwards (e.g., the thread pools of OpenBLAS and
+    OpenMP) inherit this affinity mask, but threads that already exist (such as
+    pools created when a BLAS library was imported) are not affected. Only supported
+    on Linux, a no-op elsewhere.
+
+    Parameters
+    ----------
+    cpus
+        Indices of the CPUs to run on.
+
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+@contextlib.contextmanager
+def pinned_threads(n: int, cpus: Iterable[int]) -> Generator[None, None, None]:
+    """Context manager to set the number of threads and pin the calling thread.
+
+    Combines `num_threads` with `pin_to_cpus` and restores both the environment
+    variables and the original CPU affinity on exit.
+
+    Parameters
+    ----------
+    n
+        Number of threads to set.
+    cpus
+        Indices of the CPUs to run on.
+
+    """
+    if not hasattr(os, "sched_getaffinity"):  # pragma: no cover
+        with num_threads(n):
+            yield
+        return
+
+    original_cpus = os.sched_getaffinity(0)
+    with num_threads(n):
+        pin_to_cpus(cpus)
+        try:
+            yield
+        finally:
+            pin_to_cpus(original_cpus)
+
+
+def _parse_cpulist(cpulist: str) -> list[int]:
+    """Parses a Linux CPU list, such as ``"0-11,24-35"``, into CPU indices."""
+    cpus: list[int] = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def numa_node_cpu_count(node: int = 0) -> int:
+    """Returns the number of CPUs in a NUMA node.
+
+    BLAS performance often degrades when threads span multiple NUMA nodes, so this
+    is a safe upper bound for the number of threads. Reads
+    ``/sys/devices/system/node/node{node}/cpulist`` on Linux and falls back to half
+    of `os.cpu_count` elsewhere.
+
+    Parameters
+    ----------
+    node
+        Index of the NUMA node.
+
+    """
+    try:
+        with open(f"/sys/devices/system/node/node{node}/cpulist") as f:  # noqa: PTH123
+            cpus = _parse_cpulist(f.read())
+    except OSError:  # pragma: no cover
+        cpus = []
+    if cpus:
+        return len(cpus)
+    return max(1, (os.cpu_count() or 1) // 2)  # pragma: no cover
+
+
+def numa_safe(*, overwrite: bool = True) -> None:
+    """Set the number of threads to the number of CPUs in the first NUMA node.
+
+    Shorthand for ``set_num_threads(numa_node_cpu_count(), overwrite=overwrite)``.
+    """
+    set_num_threads(numa_node_cpu_count(), overwrite=overwrite)
+
+
+@functools.lru_cache(maxsize=1)
 def _load_omp_library() -> ctypes.CDLL:
-    """Loads the OpenMP library based on the operating system."""
-    system = platform.system()
-
-    if system == "Darwin":  # pragma: no cover
-        lib_name = "libomp.dylib"
-    elif system == "Linux":  # pragma: no cover
-        lib_name = "libgomp.so.1"
-    elif system == "Windows":  # pragma: no cover
-        lib_name = "libiomp5md.dll"
-    else:  # pragma: no cover
-        msg = f"Unsupported operating system: {system}"
+    """Loads the OpenMP library based on the operating system.
+
+    The library handle is cached and the ``ctypes`` signatures of the used
+    functions are set once, at load time.
+    """
+    import ctypes  # lazy import, only needed for the OpenMP functions
+
+    if _OMP_LIB_NAME is None:  # pragma: no cover
+        msg = f"Unsupported operating system: {sys.platform}"
         raise NotImplementedError(msg)
 
     try:
-        return ctypes.CDLL(lib_name)
+        omp_lib = ctypes.CDLL(_OMP_LIB_NAME)
     except OSError as e:  # pragma: no cover
-        msg = f"Error loading {lib_name}. Make sure OpenMP is installed."
+        msg = f"Error loading {_OMP_LIB_NAME}. Make sure OpenMP is installed."
         raise OSError(msg) from e
 
+    omp_lib.omp_set_num_threads.argtypes = [ctypes.c_int]
+    omp_lib.omp_set_num_threads.restype = None
+    omp_lib.omp_get_num_threads.argtypes = []
+    omp_lib.omp_get_num_threads.restype = ctypes.c_int
+    return omp_lib
+
 
 def omp_set_num_threads(num_threads: int, *, overwrite: bool = True) -> None:
     """Sets the number of threads to be used by OpenMP parallel regions.
@@ -113,16 +368,12 @@ def omp_set_num_threads(num_threads: int, *, overwrite: bool = True) -> None:
         If true, overwrite the existing value.
     """
     if overwrite:
-        omp_lib = _load_omp_library()
-        omp_lib.omp_set_num_threads.argtypes = [ctypes.c_int]
-        omp_lib.omp_set_num_threads(num_threads)
+        _load_omp_library().omp_set_num_threads(num_threads)
 
 
 def omp_get_num_threads() -> int:
     """Returns the number of threads in the current OpenMP parallel region."""
-    omp_lib = _load_omp_library()
-    omp_lib.omp_get_num_threads.restype = ctypes.c_int
-    return omp_lib.omp_get_num_threads()
+    return _load_omp_library().omp_get_num_threads()
 
 
 @contextlib.contextmanager
@@ -148,56 +399,114 @@ def omp_num_threads(
     ...     np.ones(10)
     array([1., 1., 1., 1., 1., 1., 1., 1., 1., 1.])
     """
-    original_num_threads = omp_get_num_threads()
-    omp_set_num_threads(num_threads, overwrite=overwrite)
+    omp_lib = _load_omp_library()
+    set_ = omp_lib.omp_set_num_threads
+    original_num_threads = omp_lib.omp_get_num_threads()
+    if overwrite:
+        set_(num_threads)
 
     try:
         yield
     finally:
-        omp_set_num_threads(original_num_threads)
+        set_(original_num_threads)
+
+
+def _find_blas_setters() -> list[Callable[[int], None]]:
+    """Returns the thread count setters of the loaded BLAS libraries.
+
+    Libraries are only found if they are already loaded. Found setters are cached,
+    the other libraries are looked up again on each call.
+    """
+    import ctypes  # lazy import, only needed for the BLAS functions
+
+    candidates = [
+        (lib_name, func_name)
+        for lib_name, func_name in _BLAS_SETTER_NAMES
+        if lib_name not in _BLAS_SETTERS
+    ]
+    if sys.platform == "win32":  # pragma: no cover
+        # There is no ``RTLD_NOLOAD`` on Windows, so skip the DLLs that are not loaded
+        get_module_handle = ctypes.WinDLL("kernel32").GetModuleHandleW
+        get_module_handle.argtypes = [ctypes.c_wchar_p]
+        get_module_handle.restype = ctypes.c_void_p
+        candidates = [c for c in candidates if get_module_handle(c[0])]
+
+    mode = getattr(os, "RTLD_NOLOAD", 0)  # do not load the library if not loaded
+    for lib_name, func_name in candidates:
+        try:
+            setter = getattr(ctypes.CDLL(lib_name, mode=mode), func_name)
+        except (OSError, AttributeError):
+            continue
+        setter.argtypes = [ctypes.c_int]
+        setter.restype = None
+        _BLAS_SETTERS[lib_name] = setter
+    return list(_BLAS_SETTERS.values())
+
+
+def blas_set_num_threads(n: int = 1) -> None:
+    """Sets the number of threads of the loaded OpenBLAS and MKL libraries.
+
+    Like `omp_set_num_threads`, this calls the C API of the libraries
+    (``openblas_set_num_threads`` and ``MKL_Set_Num_Threads``) directly, so it
+    works *after* the libraries are loaded. Libraries that are not loaded yet are
+    left alone (this function never loads them). Libraries are looked up by their
+    default name, so copies vendored under a different name (such as the OpenBLAS
+    shipped in NumPy wheels) are not found; use `set_num_threads_runtime` for those.
+
+    Parameters
+    ----------
+    n
+        Number of threads to set.
+
+    """
+    for setter in _find_blas_setters():
+        setter(n)
 
 
 def print_current_thread_counts() -> None:
     """Prints the current values of the thread control environment variables."""
-    for var in THREAD_CONTROL_ENV_VARS:
-        value = os.environ.get(var, "Not set")
-        print(f"{var}: {value}")
+    get = os.environ.get
+    sys.stdout.write(
+        "".join(f"{var}: {get(var, 'Not set')}\n" for var in THREAD_CONTROL_ENV_VARS),
+    )
 
 
 def main() -> None:  # pragma: no cover
     """Command-line interface."""
+    usage = "usage: numthreads [-h] n"
     description = (
-        "Set the number of threads for OpenBLAS, MKL, OMP, NumExpr, and Accelerate."
-        " Usage: Run `numthreads <number>` to print the export commands."
-        " On Unix-like systems (Linux, macOS, WSL), use `eval $(numthreads <number>)`"
-        " in your shell to apply these settings."
-        " On Windows, in PowerShell, use `Invoke-Expression $(numthreads <number>)`."
-    )
-    parser = argparse.ArgumentParser(
-        description=description,
-    )
-    parser.add_argument(
-        "n",
-        help="Number of threads to set or use 'get' to display current settings.",
+        "Set the number of threads for OpenBLAS, MKL, OMP, NumExpr, and Accelerate.\n"
+        "Usage: Run `numthreads <number>` to print the export commands. On Unix-like\n"
+        "systems (Linux, macOS, WSL), use `eval $(numthreads <number>)` in your shell\n"
+        "to apply these settings. On Windows, in PowerShell, use `Invoke-Expression\n"
+        "$(numthreads <number>)`.\n"
+        "\n"
+        "positional arguments:\n"
+        "  n           Number of threads to set or use 'get' to display current\n"
+        "              settings.\n"
+        "\n"
+        "options:\n"
+        "  -h, --help  show this help message and exit"
     )
-    args = parser.parse_args(args=None if sys.argv[1:] else ["--help"])
+    # A hand-rolled parser, because importing ``argparse`` dominates the startup time
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print(f"{usage}\n\n{description}")
+        return
+    if len(args) > 1:
+        msg = f"unrecognized arguments: {' '.join(args[1:])}"
+        sys.exit(f"{usage}\nnumthreads: error: {msg}")
 
-    if args.n == "get":
+    if args[0] == "get":
         print_current_thread_counts()
         return
 
-    n = int(args.n)
-    system = platform.system()
-    if system == "Windows":
-        export_commands = " & ".join(
-            f"$env:{var}='{n}'" for var in THREAD_CONTROL_ENV_VARS
-        )
-        print(f'powershell.exe -Command "{export_commands}"')
-    else:
-        export_commands = " ; ".join(
-            f"export {var}='{n}'" for var in THREAD_CONTROL_ENV_VARS
-        )
-        print(export_commands)
+    try:
+        n = int(args[0])
+    except ValueError:
+        sys.exit(f"{usage}\nnumthreads: error: invalid number of threads: {args[0]!r}")
+
+    print(_EXPORT_TEMPLATE.replace(_N, str(n)))
 
 
 # Pytest Plugin Integration
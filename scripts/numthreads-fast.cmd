@@ -0,0 +1,21 @@
+@echo off
+rem Python-free equivalent of `numthreads N`, which avoids the interpreter
+rem startup time. Use in PowerShell: Invoke-Expression $(numthreads-fast.cmd N)
+rem Keep the variables in sync with `THREAD_CONTROL_ENV_VARS` in numthreads.py.
+setlocal
+set "n=%~1"
+if not defined n goto wrong_args
+if not "%~2"=="" goto wrong_args
+rem Only digits are allowed, so any token left after splitting on digits is invalid
+for /f "delims=0123456789" %%c in ("%n%") do (
+    echo usage: numthreads-fast n 1>&2
+    echo numthreads-fast: error: invalid number of threads: '%n%' 1>&2
+    exit /b 1
+)
+echo powershell.exe -Command "$env:OPENBLAS_NUM_THREADS='%n%' & $env:MKL_NUM_THREADS='%n%' & $env:OMP_NUM_THREADS='%n%' & $env:NUMEXPR_NUM_THREADS='%n%' & $env:VECLIB_MAXIMUM_THREADS='%n%'"
+exit /b 0
+
+:wrong_args
+echo usage: numthreads-fast n 1>&2
+echo numthreads-fast: error: expected exactly one argument 1>&2
+exit /b 1
@@ -1,15 +1,32 @@
 """Tests for ``numthreads`` package."""
 import os
+import subprocess
+import sys
+from pathlib import Path
 
 import pytest
+from pytest_mock import MockerFixture
 
 from numthreads import (
+    _BLAS_SETTERS,
+    _EXPORT_TEMPLATES,
+    _UNSYNCED_ENV_VARS,
+    THREAD_CONTROL_ENV_VARS,
+    _load_omp_library,
+    _parse_cpulist,
+    blas_set_num_threads,
+    main,
     num_threads,
+    num_threads_runtime,
+    numa_node_cpu_count,
+    numa_safe,
     omp_get_num_threads,
     omp_num_threads,
     omp_set_num_threads,
+    pinned_threads,
     print_current_thread_counts,
     set_num_threads,
+    set_num_threads_runtime,
 )
 
 
@@ -100,3 +117,209 @@ def test_print_current_thread_counts(capsys: pytest.CaptureFixture) -> None:
     set_num_threads(4)
     print_current_thread_counts()
     assert "OPENBLAS_NUM_THREADS: 4" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(
+    os.name != "posix",
+    reason="OMP functions are tested only on POSIX systems",
+)
+def test_load_omp_library_is_cached() -> None:
+    assert _load_omp_library() is _load_omp_library()
+
+
+def test_num_threads_context_manager_unsets(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    monkeypatch.setenv("MKL_NUM_THREADS", "3")
+    with num_threads(2):
+        assert os.environ["OMP_NUM_THREADS"] == "2"
+        assert os.environ["MKL_NUM_THREADS"] == "2"
+    assert "OMP_NUM_THREADS" not in os.environ
+    assert os.environ["MKL_NUM_THREADS"] == "3"
+
+
+def _process_env(var: str) -> str:
+    """Returns ``var`` as seen by a subprocess, i.e., from the real environment."""
+    code = f"import os; print(os.environ.get({var!r}))"
+    out = subprocess.check_output([sys.executable, "-c", code])  # noqa: S603
+    return out.decode().strip()
+
+
+def test_set_num_threads_visible_to_subprocess() -> None:
+    set_num_threads(5)
+    assert _process_env("OPENBLAS_NUM_THREADS") == "5"
+
+
+def test_main(
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture,
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["numthreads", "--help"])
+    main()
+    assert capsys.readouterr().out.startswith("usage: numthreads [-h] n")
+
+    monkeypatch.setattr(sys, "argv", ["numthreads", "1", "2"])
+    with pytest.raises(SystemExit, match="unrecognized arguments: 2"):
+        main()
+
+    monkeypatch.setattr(sys, "argv", ["numthreads", "four"])
+    with pytest.raises(SystemExit, match="invalid number of threads"):
+        main()
+
+
+def test_set_num_threads_skips_unchanged(
+    mocker: MockerFixture,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    for var in THREAD_CONTROL_ENV_VARS:
+        monkeypatch.setenv(var, "3")
+    putenv = mocker.patch("os.putenv")
+    set_num_threads(3)
+    putenv.assert_not_called()
+    set_num_threads(2)
+    assert putenv.call_count == 5
+    # Unpatch, such that ``monkeypatch`` also restores the real environment
+    mocker.stopall()
+
+
+@pytest.mark.skipif(
+    os.name != "posix",
+    reason="The shell script is tested only on POSIX systems",
+)
+def test_numthreads_fast_script() -> None:
+    script = Path(__file__).parent.parent / "scripts" / "numthreads-fast"
+    out = subprocess.check_output(["/bin/sh", str(script), "4"])  # noqa: S603
+    assert out.decode().strip() == _EXPORT_TEMPLATES["default"].replace("<<N>>", "4")
+
+
+def test_set_num_threads_runtime(
+    mocker: MockerFixture,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setitem(sys.modules, "threadpoolctl", None)  # not installed
+    set_num_threads_runtime(3)
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "3"
+
+    threadpoolctl = mocker.MagicMock()
+    monkeypatch.setitem(sys.modules, "threadpoolctl", threadpoolctl)
+    set_num_threads_runtime(2)
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "2"
+    threadpoolctl.threadpool_limits.assert_called_once_with(limits=2)
+
+
+def test_num_threads_runtime(
+    mocker: MockerFixture,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("OPENBLAS_NUM_THREADS", "1")
+    threadpoolctl = mocker.MagicMock()
+    monkeypatch.setitem(sys.modules, "threadpoolctl", threadpoolctl)
+    limits = threadpoolctl.threadpool_limits.return_value
+    with num_threads_runtime(2):
+        assert os.environ["OPENBLAS_NUM_THREADS"] == "2"
+        limits.__enter__.assert_called_once()
+        limits.__exit__.assert_not_called()
+    limits.__exit__.assert_called_once()
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "1"
+
+
+def test_blas_set_num_threads(mocker: MockerFixture) -> None:
+    blas_set_num_threads(2)  # no BLAS library loaded, nothing happens
+
+    mocker.patch.dict(_BLAS_SETTERS, clear=True)
+    cdll = mocker.patch("ctypes.CDLL")
+    blas_set_num_threads(2)
+    setter = cdll.return_value.openblas_set_num_threads
+    setter.assert_called_once_with(2)
+    assert setter.argtypes is not None
+
+    # The setters are cached
+    cdll.reset_mock()
+    blas_set_num_threads(3)
+    cdll.assert_not_called()
+    setter.assert_called_with(3)
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "sched_getaffinity"),
+    reason="CPU affinity is only supported on Linux",
+)
+def test_pinned_threads() -> None:
+    original_cpus = os.sched_getaffinity(0)
+    cpu = min(original_cpus)
+    with pinned_threads(1, [cpu]):
+        assert os.sched_getaffinity(0) == {cpu}
+        assert os.environ["OMP_NUM_THREADS"] == "1"
+    assert os.sched_getaffinity(0) == original_cpus
+
+
+def test_parse_cpulist() -> None:
+    assert _parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert _parse_cpulist("") == []
+
+
+def test_numa_safe() -> None:
+    n = numa_node_cpu_count()
+    assert n >= 1
+    numa_safe()
+    assert os.environ["OPENBLAS_NUM_THREADS"] == str(n)
+
+
+def test_set_num_threads_fast(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("OPENBLAS_NUM_THREADS", "1")
+    # ``num_threads`` restores the real environment and resets the unsynced variables
+    with num_threads(1):
+        set_num_threads(6, fast=True)
+        assert os.environ["OPENBLAS_NUM_THREADS"] == "1"  # not mirrored
+        assert _process_env("OPENBLAS_NUM_THREADS") == "6"
+    assert not _UNSYNCED_ENV_VARS
+    assert _process_env("OPENBLAS_NUM_THREADS") == "1"
+
+
+def test_set_num_threads_runtime_reraises_inner_import_error(
+    mocker: MockerFixture,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    threadpoolctl = mocker.MagicMock()
+    threadpoolctl.threadpool_limits.side_effect = ImportError("broken")
+    monkeypatch.setitem(sys.modules, "threadpoolctl", threadpoolctl)
+    with pytest.raises(ImportError, match="broken"):
+        set_num_threads_runtime(2)
+    with pytest.raises(ImportError, match="broken"), num_threads_runtime(2):
+        pass
+
+
+def test_set_num_threads_after_fast(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("OPENBLAS_NUM_THREADS", "1")
+    set_num_threads(6, fast=True)
+    set_num_threads(1)
+    assert _process_env("OPENBLAS_NUM_THREADS") == "1"
+
+
+def test_num_threads_restores_after_fast(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("MKL_NUM_THREADS", "2")
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    with num_threads(2):
+        del os.environ["OMP_NUM_THREADS"]
+        set_num_threads(7, fast=True)
+    assert _process_env("MKL_NUM_THREADS") == "2"
+    assert _process_env("OMP_NUM_THREADS") == "None"
+
+
+def test_set_num_threads_non_int(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("OPENBLAS_NUM_THREADS", "1")
+    set_num_threads(2.0)  # type: ignore[arg-type]
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "2.0"
+    set_num_threads(True)  # noqa: FBT003
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "True"
+    set_num_threads(1000)
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "1000"
+
+
+def test_set_num_threads_patched_environ(monkeypatch: pytest.MonkeyPatch) -> None:
+    environ = {"MKL_NUM_THREADS": "1"}
+    monkeypatch.setattr(os, "environ", environ)
+    set_num_threads(3)
+    assert environ["OPENBLAS_NUM_THREADS"] == "3"
+    with num_threads(2):
+        assert environ["MKL_NUM_THREADS"] == "2"
+    assert environ == {var: "3" for var in THREAD_CONTROL_ENV_VARS}